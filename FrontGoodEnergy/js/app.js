@@ -135,24 +135,36 @@ function initializeTopbarButtons() {
     const notifBtn = el('notificationsBtn'), notifPopup = el('notificationsPopup');
     if (notifBtn && notifPopup) {
         const alertsContainer = el('popupAlerts'), badge = el('notificationBadge');
-        const allPossibleAlerts = [{ type: 'warn', text: 'Detecção de consumo anômalo.' }, { type: 'success', text: 'Produção solar 20% acima da média hoje!' }, { type: 'info', text: 'Lembrete: Limpeza dos painéis recomendada.' }];
+        const noAlerts = [{ type: 'info', text: 'Nenhuma anomalia detectada no inversor.' }];
+        // Horário do alerta mais recente já visto: só alertas posteriores a ele contam no badge
+        let detectedAlerts = [];
+        const lastSeenAlert = () => localStorage.getItem('lastSeenAlertTime') || '';
         
-        const updateNotifications = () => {
+        const updateNotifications = async () => {
             if (user?.notifications === 'disabled') {
                 if(alertsContainer) alertsContainer.innerHTML = '<div class="row info"><div>As notificações estão silenciadas.</div></div>';
                 if(badge) badge.classList.add('hide');
                 return;
             }
-            const alertsToShow = allPossibleAlerts.sort(() => 0.5 - Math.random()).slice(0, Math.floor(Math.random() * 3) + 1);
-            if (alertsContainer) alertsContainer.innerHTML = alertsToShow.map(a => `<div class="row ${a.type}"><span class="tag">${a.type === 'warn' ? 'Atenção' : a.type === 'success' ? 'Dica' : 'Info'}</span><div>${a.text}</div></div>`).join('');
+            try {
+                const response = await fetch('http://127.0.0.1:5000/api/alerts?limit=5');
+                if (response.ok) detectedAlerts = await response.json();
+            } catch (error) { console.error('Erro ao buscar alertas:', error); }
+            const alertsToShow = detectedAlerts.length > 0 ? detectedAlerts : noAlerts;
+            if (alertsContainer) alertsContainer.innerHTML = alertsToShow.map(a => `<div class="row ${a.type}"><span class="tag">${a.type === 'warn' ? 'Atenção' : a.type === 'success' ? 'Dica' : 'Info'}</span><div>${a.text}${a.time ? `<br><small>${new Date(a.time).toLocaleString('pt-BR')}</small>` : ''}</div></div>`).join('');
+            const unseenAlerts = detectedAlerts.filter(a => a.time > lastSeenAlert());
             if (badge) {
-                if (alertsToShow.length > 0) { badge.textContent = alertsToShow.length; if (notifPopup.classList.contains('hide')) badge.classList.remove('hide'); } else { badge.classList.add('hide'); }
+                if (unseenAlerts.length > 0) { badge.textContent = unseenAlerts.length; if (notifPopup.classList.contains('hide')) badge.classList.remove('hide'); } else { badge.classList.add('hide'); }
             }
         };
         setInterval(updateNotifications, 30000);
         updateNotifications();
 
-        notifBtn.addEventListener('click', (e) => { e.stopPropagation(); notifPopup.classList.toggle('hide'); if (badge) badge.classList.add('hide'); });
+        notifBtn.addEventListener('click', (e) => {
+            e.stopPropagation(); notifPopup.classList.toggle('hide'); if (badge) badge.classList.add('hide');
+            // Ao abrir as notificações, os alertas exibidos passam a contar como vistos
+            if (detectedAlerts.length > 0) localStorage.setItem('lastSeenAlertTime', detectedAlerts[0].time);
+        });
         document.addEventListener('click', () => notifPopup.classList.add('hide'));
         notifPopup.addEventListener('click', e => e.stopPropagation());
     }
@@ -425,7 +437,7 @@ function devicesInit() {
                 <td>${d.name}</td>
                 <td>${d.room}</td>
                 <td>${d.watts} W</td>
-                <td>${d.cost_per_hour}</td>
+                <td>R$ ${Number(d.cost_per_hour || 0).toFixed(2)}</td>
                 <td><span class="tag ${d.on ? 'success' : 'fail'}">${d.on ? 'Ligado' : 'Desligado'}</span></td>
                 <td class="device-actions">
                     <button class="icon-btn" data-action="toggle" data-id="${d.id}" data-state="${d.on}" title="${d.on ? 'Desligar' : 'Ligar'}"><svg fill="none" stroke="currentColor" viewBox="0 0 24 24"><path stroke-linecap="round" stroke-linejoin="round" d="M5.636 18.364a9 9 0 010-12.728m12.728 0a9 9 0 010 12.728m-9.9-2.829a5 5 0 010-7.07m7.072 0a5 5 0 010 7.07M12 6v6"></path></svg></button>
@@ -450,7 +462,12 @@ function devicesInit() {
         if (!button) return;
         const { action, id, state } = button.dataset;
         if (action === 'toggle') {
-            try { await fetch(`http://127.0.0.1:5000/api/devices/${id}`, { method: 'PUT', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ email: user.email, on: !(state === 'true') }) }); fetchAndRender(); } catch (error) { showToast('Erro ao atualizar dispositivo.', 'error'); }
+            try {
+                // O PATCH já devolve a lista atualizada, então não é preciso buscar os dispositivos de novo
+                const response = await fetch('http://127.0.0.1:5000/api/devices', { method: 'PATCH', headers: { 'Content-Type': 'application/json' }, body: JSON.stringify({ email: user.email, ids: [id], on: !(state === 'true') }) });
+                if (!response.ok) throw new Error();
+                render(await response.json());
+            } catch (error) { showToast('Erro ao atualizar dispositivo.', 'error'); }
         }
         if (action === 'delete') {
             const confirmed = await showConfirmDialog('Excluir Dispositivo', 'Esta ação é permanente. Tem certeza que deseja excluir este dispositivo?');
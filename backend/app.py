@@ -1,17 +1,44 @@
 # --- IMPORTAÇÕES DE BIBLIOTECAS ---
 # Bibliotecas necessárias para o funcionamento do servidor.
 from dotenv import load_dotenv  # Carrega variáveis de ambiente de um arquivo .env (como chaves de API)
-from flask import Flask, request, jsonify  # O framework web para criar a API
+from flask import Flask, request, jsonify, Response, g, send_from_directory  # O framework web para criar a API
+from flask.json.provider import DefaultJSONProvider  # Base para o codificador JSON compacto das respostas
 from flask_cors import CORS  # Permite que o frontend (em outro domínio) acesse esta API
 import random  # Usado para gerar dados simulados (ex: status da bateria)
 import json  # Para manipular arquivos e dados no formato JSON
+import math  # Validação de números (ex: tarifas finitas)
+import gzip  # Compressão das respostas grandes da API
 import os  # Para interagir com o sistema operacional (caminhos de arquivos, etc.)
 import pandas as pd  # Biblioteca poderosa para manipulação e análise de dados (arquivos CSV)
+import numpy as np  # Cálculos vetorizados sobre os arrays de dados do inversor (tarifas, somas acumuladas)
 from datetime import datetime, timedelta  # Para trabalhar com datas e horas
 from werkzeug.security import generate_password_hash, check_password_hash # Para criptografar e verificar senhas de forma segura
 import uuid  # Para gerar IDs únicos para os dispositivos
+from collections import deque, Counter  # Fila de tamanho fixo para os alertas e contagem das pilhas do profiler
+import cProfile  # Profiler determinístico usado nas capturas sob demanda
+import threading  # Trava da detecção de anomalias e thread de amostragem do profiler
+import sys  # Acesso às pilhas de chamadas das threads em execução
+import time  # Relógio de alta resolução para medir a duração das requisições
+import hmac  # Comparação segura do token de administrador
 import google.generativeai as genai # SDK do Google para interagir com a API Gemini
 
+# O pyarrow é opcional: sem ele, a exportação em Parquet fica indisponível
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = pq = None
+
+# Dependências opcionais de desempenho: sem elas, as respostas usam o módulo json padrão e apenas gzip
+try:
+    import orjson  # Codificador JSON mais rápido
+except ImportError:
+    orjson = None
+try:
+    import brotli  # Compressão mais eficiente que o gzip, quando o navegador aceita
+except ImportError:
+    brotli = None
+
 # --- CONFIGURAÇÃO INICIAL ---
 
 # Carrega as variáveis de ambiente do arquivo .env
@@ -24,11 +51,95 @@ genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 # 'gemini-2.0-flash' é um modelo rápido e eficiente para tarefas como chat e resumo.
 model = genai.GenerativeModel('gemini-2.0-flash')
 
+# --- CODIFICAÇÃO E COMPRESSÃO DAS RESPOSTAS ---
+
+JSON_FLOAT_PRECISION = 4 # Casas decimais dos números enviados nas respostas JSON
+COMPRESSION_MIN_BYTES = 1024 # Respostas menores que isso não compensam ser comprimidas
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def round_floats(data):
+    """
+    Arredonda todos os números decimais de uma estrutura (dicts e listas aninhados) para JSON_FLOAT_PRECISION casas,
+    evitando enviar a representação completa de floats como 13.699999999999818.
+    Args:
+        data: O dado a ser serializado.
+    Returns:
+        O mesmo dado, com os floats arredondados.
+    """
+    if isinstance(data, float):
+        return round(float(data), JSON_FLOAT_PRECISION)
+    if isinstance(data, dict):
+        return {key: round_floats(value) for key, value in data.items()}
+    if isinstance(data, (list, tuple)):
+        return [round_floats(value) for value in data]
+    return data
+
+class CompactJSONProvider(DefaultJSONProvider):
+    """
+    Codificador JSON usado pelo jsonify: sempre compacto (sem indentação, mesmo em modo debug),
+    com floats de precisão fixa e usando o orjson quando ele estiver instalado.
+    """
+    compact = True
+
+    def dumps(self, obj, **kwargs):
+        obj = round_floats(obj)
+        if orjson is not None:
+            # Tipos que o orjson não conhece (Decimal, datas, etc.) caem no mesmo 'default' do Flask, e as datas passam
+            # por ele também, para que os dois codificadores aceitem os mesmos tipos e gerem a mesma saída
+            options = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            return orjson.dumps(obj, default=self.default, option=options).decode('utf-8')
+        return super().dumps(obj, **kwargs)
+
+def to_columnar(times, **columns):
+    """
+    Monta o layout colunar compacto para séries temporais: arrays paralelos e horários
+    codificados como deltas, em segundos, a partir do primeiro ('t0', em epoch).
+    Args:
+        times (pandas.DatetimeIndex): Os horários de cada ponto da série.
+        **columns: As colunas de valores, uma lista por nome.
+    Returns:
+        dict: {'t0': ..., 'dt': [...], <coluna>: [...]}. Com 'dt' começando em 0, a soma acumulada
+              de 'dt' somada a 't0' reconstrói cada horário.
+    """
+    seconds = times.as_unit('s').asi8
+    return {
+        "t0": int(seconds[0]) if len(seconds) else None,
+        "dt": np.diff(seconds, prepend=seconds[:1]).tolist(),
+        **{name: list(values) for name, values in columns.items()}
+    }
+
 # Inicializa a aplicação Flask
 app = Flask(__name__)
+app.json = CompactJSONProvider(app)
 # Habilita o CORS para toda a aplicação, permitindo requisições do frontend.
 CORS(app)
 
+def compress_data(data, encoding):
+    """Comprime o corpo de uma resposta com 'br' (brotli) ou 'gzip'."""
+    return brotli.compress(data, quality=BROTLI_QUALITY) if encoding == 'br' else gzip.compress(data, GZIP_LEVEL)
+
+@app.after_request
+def compress_response(response):
+    """
+    Comprime as respostas acima de COMPRESSION_MIN_BYTES com brotli ou gzip, conforme o
+    cabeçalho Accept-Encoding do navegador. Respostas em streaming (ex: /api/export) não passam por aqui.
+    """
+    if (response.direct_passthrough or response.is_streamed or not 200 <= response.status_code < 300
+            or 'Content-Encoding' in response.headers):
+        return response
+    accepted = request.accept_encodings
+    encoding = 'br' if brotli is not None and accepted['br'] else 'gzip' if accepted['gzip'] else None
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESSION_MIN_BYTES:
+        return response
+    response.set_data(compress_data(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    return response
+
 # --- GERENCIAMENTO DE ARQUIVOS E DIRETÓRIOS ---
 
 # Define caminhos de diretório de forma robusta para funcionar em qualquer sistema operacional
@@ -68,6 +179,154 @@ USERS_FILE = os.path.join(DATA_DIR, 'users.json') # Armazena dados dos usuários
 DEVICES_FILE = os.path.join(DATA_DIR, 'dispositivos.json') # Armazena os dispositivos de cada usuário
 CHAT_HISTORY_FILE = os.path.join(DATA_DIR, 'chat_history.json') # Armazena o histórico de chat com o agente
 
+# --- PROFILING SOB DEMANDA ---
+# Desativado por padrão. Variáveis de ambiente (.env) para ativar:
+# PROFILE_ADMIN_TOKEN: habilita o cabeçalho 'X-Profile-Token'. Uma requisição com o token correto é
+#                      capturada, e o mesmo token dá acesso à lista e ao download das capturas.
+# PROFILE_SAMPLE_RATE: fração das requisições capturadas automaticamente (ex: 0.01 = 1%).
+# PROFILE_ROUTES: caminhos que podem ser capturados, separados por vírgula (vazio = todas as rotas /api/).
+# PROFILE_FORMAT: 'pstats' (cProfile, padrão) ou 'collapsed' (pilhas amostradas, para flamegraphs).
+#                 Pode ser escolhido por requisição com o cabeçalho 'X-Profile-Format'.
+# PROFILE_MAX_FILES: quantas capturas manter em disco; as mais antigas são apagadas.
+
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', 0))
+PROFILE_ROUTES = {route.strip() for route in os.getenv('PROFILE_ROUTES', '').split(',') if route.strip()}
+PROFILE_FORMAT = os.getenv('PROFILE_FORMAT', 'pstats')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', 20))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(BASE_DIR, 'profiles'))
+PROFILE_SAMPLE_INTERVAL = 0.001 # Segundos entre duas amostras de pilha no formato 'collapsed'
+PROFILE_EXTENSIONS = {"pstats": "prof", "collapsed": "collapsed"}
+PROFILING_ENABLED = bool(PROFILE_ADMIN_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+class StackSampler(threading.Thread):
+    """
+    Amostra periodicamente a pilha de chamadas de uma thread (a que atende a requisição) e conta
+    quantas vezes cada pilha apareceu. O resultado sai no formato 'collapsed' ("a;b;c 12"),
+    que é a entrada das ferramentas de flamegraph.
+    """
+
+    def __init__(self, target_thread_id):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(PROFILE_SAMPLE_INTERVAL):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+    def dump_stats(self, path):
+        """Salva as pilhas contadas (mesmo nome do método do cProfile, para os dois serem salvos igual)."""
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+def is_profile_admin(req):
+    """Verifica se a requisição traz o token de administrador do profiling."""
+    token = req.headers.get('X-Profile-Token', '')
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest(token.encode(), PROFILE_ADMIN_TOKEN.encode())
+
+def start_profiling():
+    """
+    Decide se a requisição atual será capturada (token de administrador ou sorteio pela taxa de amostragem)
+    e, se for, inicia o profiler no formato escolhido.
+    """
+    if request.path.startswith('/api/admin/profiles') or (PROFILE_ROUTES and request.path not in PROFILE_ROUTES):
+        return
+    if not PROFILE_ROUTES and not request.path.startswith('/api/'):
+        return
+    if not is_profile_admin(request) and random.random() >= PROFILE_SAMPLE_RATE:
+        return
+    profile_format = request.headers.get('X-Profile-Format', PROFILE_FORMAT)
+    if profile_format not in PROFILE_EXTENSIONS:
+        return
+    try:
+        if profile_format == 'collapsed':
+            profiler = StackSampler(threading.get_ident())
+            profiler.start()
+        else:
+            profiler = cProfile.Profile()
+            profiler.enable()
+    except ValueError:
+        # Outro profiler já está ativo (ex: duas requisições capturadas ao mesmo tempo); esta não é capturada
+        return
+    g.profiler, g.profile_format, g.profile_start = profiler, profile_format, time.perf_counter()
+
+def profile_capture_name():
+    """Monta o nome do arquivo da captura atual: horário, endpoint, duração e extensão do formato."""
+    elapsed_ms = (time.perf_counter() - g.profile_start) * 1000
+    return f"{datetime.now():%Y%m%d-%H%M%S-%f}_{request.endpoint or 'unknown'}_{elapsed_ms:.0f}ms.{PROFILE_EXTENSIONS[g.profile_format]}"
+
+def name_profile_capture(response):
+    """
+    Define o nome da captura da requisição atual, se houver, e o informa no cabeçalho 'X-Profile-Capture'.
+    O profiler em si só é encerrado em stop_profiling(), que roda mesmo quando a requisição falha.
+    """
+    if 'profiler' in g:
+        g.profile_filename = profile_capture_name()
+        response.headers['X-Profile-Capture'] = g.profile_filename
+    return response
+
+def stop_profiling(exception=None):
+    """
+    Encerra a captura da requisição atual, se houver, e salva o arquivo no anel em disco.
+    Roda no teardown da requisição, então o profiler é desligado mesmo quando a rota lança uma exceção.
+    Respostas em streaming (ex: /api/export) só têm medida a parte feita antes do envio começar.
+    """
+    profiler = g.pop('profiler', None)
+    if profiler is None:
+        return
+    try:
+        if g.profile_format == 'collapsed':
+            profiler.stop()
+        else:
+            profiler.disable()
+        filename = g.pop('profile_filename', None) or profile_capture_name()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, filename))
+        prune_profiles()
+    except Exception as e:
+        # Uma falha ao salvar a captura nunca deve afetar a requisição
+        print(f"ERRO ao salvar a captura do profiler: {e}")
+
+def profile_mtime(name):
+    """Data de modificação de uma captura (0 se ela acabou de ser apagada por outra requisição)."""
+    try:
+        return os.path.getmtime(os.path.join(PROFILE_DIR, name))
+    except FileNotFoundError:
+        return 0
+
+def list_profiles():
+    """Lista as capturas salvas, da mais antiga para a mais recente."""
+    if not os.path.isdir(PROFILE_DIR): return []
+    names = [name for name in os.listdir(PROFILE_DIR) if name.rsplit('.', 1)[-1] in PROFILE_EXTENSIONS.values()]
+    return sorted(names, key=profile_mtime)
+
+def prune_profiles():
+    """Mantém no máximo PROFILE_MAX_FILES capturas em disco, apagando as mais antigas."""
+    profiles = list_profiles()
+    for name in profiles[:max(len(profiles) - PROFILE_MAX_FILES, 0)]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass # Outra requisição já apagou esta captura
+
+# Os ganchos só são registrados com o profiling ativado, então ele não tem custo algum quando desligado
+if PROFILING_ENABLED:
+    app.before_request(start_profiling)
+    app.after_request(name_profile_capture)
+    app.teardown_request(stop_profiling)
+
 # --- FUNÇÕES AUXILIARES DE MANIPULAÇÃO DE DADOS ---
 
 def read_json_file(filepath, default_data):
@@ -102,6 +361,12 @@ def write_json_file(filepath, data):
         # Escreve o JSON de forma formatada (indent=2) e garantindo a codificação correta (ensure_ascii=False)
         json.dump(data, f, indent=2, ensure_ascii=False)
 
+# Colunas de telemetria do inversor usadas pela detecção de anomalias
+MODE_COL = 'Working Mode' # Estado do inversor (Normal, Check, Wait, ou um código de falha)
+TEMPERATURE_COL = 'Temperature(C)' # Temperatura interna do inversor
+MPPT_COLS = (('V MPPT 1(V)', 'I MPPT 1(A)'), ('V MPPT 2(V)', 'I MPPT 2(A)')) # Tensão e corrente de cada string
+TELEMETRY_COLS = [col for pair in MPPT_COLS for col in pair] + ['F AC 1(Hz)', TEMPERATURE_COL, 'PF']
+
 # Variáveis para implementar um sistema de cache simples para os dados do inversor
 inverter_data_cache = None # Armazena o dataframe do Pandas em memória
 cache_time = None # Armazena o timestamp de quando o cache foi criado
@@ -132,15 +397,25 @@ def get_inverter_data():
         # Converte a coluna 'Time' para o formato de data e hora do pandas.
         df['Time'] = pd.to_datetime(df['Time'], format='%d.%m.%Y %H:%M:%S')
         
+        # O símbolo '℃' do cabeçalho não sobrevive à leitura em latin1, então a coluna é renomeada
+        df.rename(columns={col: TEMPERATURE_COL for col in df.columns if col.startswith('Temperature')}, inplace=True)
+        
         # Define as colunas que devem ser numéricas
         numeric_cols = ['Power(W)', 'Total Generation(kWh)']
-        for col in numeric_cols:
+        for col in numeric_cols + TELEMETRY_COLS:
+            if col not in df.columns: continue
             # Converte as colunas para número, substituindo vírgulas por pontos.
             # errors='coerce' transforma valores inválidos em NaN (Not a Number).
             df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.'), errors='coerce')
         
         # Remove quaisquer linhas que tenham valores nulos nas colunas numéricas
+        # (a telemetria é opcional: leituras incompletas continuam valendo para a geração)
         df.dropna(subset=numeric_cols, inplace=True)
+        # Garante a ordem cronológica, necessária para as buscas binárias por intervalo de tempo
+        df.sort_values('Time', inplace=True, ignore_index=True)
+        
+        # Etapa de detecção de anomalias: processa o histórico na primeira carga e só as linhas novas depois
+        run_anomaly_detection(df)
         
         # Atualiza o cache
         inverter_data_cache = df
@@ -151,6 +426,474 @@ def get_inverter_data():
         print(f"ERRO ao processar o arquivo CSV histórico: {e}")
         return None
 
+# --- TARIFAS POR HORÁRIO E CÁLCULO DE ECONOMIA ---
+
+# Postos tarifários (modelo da Tarifa Branca). A posição de cada posto na tupla é o índice usado nos arrays.
+TARIFF_BANDS = ('offPeak', 'intermediate', 'peak') # Fora de ponta, intermediário e ponta
+PEAK_HOURS = (18, 19, 20) # Horas de ponta nos dias úteis
+INTERMEDIATE_HOURS = (17, 21) # Horas intermediárias (antes e depois da ponta) nos dias úteis
+DEFAULT_TARIFF = 0.95 # Tarifa única padrão (R$/kWh) usada quando o usuário não configurou nada
+
+# Cache com os arrays que não dependem do usuário (energia por intervalo, posto de cada leitura, etc.)
+tariff_base_cache = None
+# Cache com as somas acumuladas de economia. Chave: a tupla de preços (usuários com as mesmas tarifas
+# compartilham o mesmo array), então o cache cresce com as tarifas cadastradas e não com os e-mails consultados.
+user_savings_cache = {}
+
+def get_user_tariff_prices(user):
+    """
+    Monta os preços (R$/kWh) de cada posto tarifário para um usuário.
+    Usuários sem 'tariffSchedule' continuam com a tarifa única ('tariff') em todos os postos.
+    Args:
+        user (dict): O registro do usuário vindo do users.json.
+    Returns:
+        tuple: Os preços na mesma ordem de TARIFF_BANDS.
+    """
+    flat_tariff = float(user.get('tariff', DEFAULT_TARIFF))
+    schedule = user.get('tariffSchedule') or {}
+    return tuple(float(schedule.get(band, flat_tariff)) for band in TARIFF_BANDS)
+
+def get_tariff_base(df):
+    """
+    Calcula (uma vez por carga do CSV) os arrays compartilhados por todos os usuários:
+    a energia de cada intervalo (diferença da 'Total Generation(kWh)'), o posto tarifário de cada
+    leitura e as somas acumuladas de energia. Também indexa onde começa e termina cada dia e mês,
+    para que qualquer consulta seja feita com duas leituras nos arrays acumulados.
+    Args:
+        df (pandas.DataFrame): Os dados do inversor retornados por get_inverter_data().
+    Returns:
+        dict: Os arrays e índices pré-calculados.
+    """
+    global tariff_base_cache
+    # Os arrays só precisam ser refeitos quando o DataFrame do cache do inversor for recarregado
+    if tariff_base_cache is not None and tariff_base_cache['source'] is df:
+        return tariff_base_cache
+
+    times = df['Time'].to_numpy(dtype='datetime64[ns]')
+    total_generation = df['Total Generation(kWh)'].to_numpy(dtype=float)
+    # Energia gerada entre uma leitura e a anterior. Quedas no contador (reset) não contam como geração.
+    energy = np.clip(np.diff(total_generation, prepend=total_generation[:1]), 0, None)
+
+    # Posto tarifário de cada leitura: ponta e intermediário só valem em dias úteis
+    hours = df['Time'].dt.hour.to_numpy()
+    weekdays = df['Time'].dt.weekday.to_numpy() < 5
+    bands = np.zeros(len(df), dtype=np.int8)
+    bands[weekdays & np.isin(hours, INTERMEDIATE_HOURS)] = TARIFF_BANDS.index('intermediate')
+    bands[weekdays & np.isin(hours, PEAK_HOURS)] = TARIFF_BANDS.index('peak')
+
+    # Somas acumuladas com um zero na frente: a soma do intervalo [i, j) é cum[j] - cum[i]
+    energy_by_band = np.zeros((len(TARIFF_BANDS), len(df)))
+    energy_by_band[bands, np.arange(len(df))] = energy
+
+    tariff_base_cache = {
+        "source": df,
+        "times": times,
+        "energy": energy,
+        "bands": bands,
+        "cum_energy": np.concatenate(([0.0], np.cumsum(energy))),
+        "cum_energy_by_band": np.hstack((np.zeros((len(TARIFF_BANDS), 1)), np.cumsum(energy_by_band, axis=1))),
+        "days": index_periods(times, 'D'),
+        "months": index_periods(times, 'M'),
+    }
+    return tariff_base_cache
+
+def index_periods(times, unit):
+    """
+    Mapeia cada período (dia ou mês) presente nos dados para o intervalo [início, fim) de suas linhas.
+    Args:
+        times (numpy.ndarray): Os horários das leituras, em ordem crescente.
+        unit (str): 'D' para dias ou 'M' para meses.
+    Returns:
+        dict: Chave 'AAAA-MM-DD' (dias) ou 'AAAA-MM' (meses), valor (início, fim).
+    """
+    periods, starts = np.unique(times.astype(f'datetime64[{unit}]'), return_index=True)
+    ends = np.append(starts[1:], len(times))
+    return {str(period): (int(start), int(end)) for period, start, end in zip(periods, starts, ends)}
+
+def get_user_cum_savings(df, user):
+    """
+    Retorna a soma acumulada da economia (R$) de um usuário, precificando cada intervalo de
+    energia pelo posto tarifário do seu horário. O resultado fica em cache pelas tarifas do usuário
+    e só é recalculado quando os dados do inversor mudam ou quando aparecem tarifas novas.
+    Args:
+        df (pandas.DataFrame): Os dados do inversor.
+        user (dict): O registro do usuário, de onde vêm as tarifas.
+    Returns:
+        numpy.ndarray: Array com len(df) + 1 posições, começando em zero.
+    """
+    base = get_tariff_base(df)
+    prices = get_user_tariff_prices(user)
+    cached = user_savings_cache.get(prices)
+    if cached and cached['base'] is base:
+        return cached['cum_savings']
+    # Arrays calculados sobre dados antigos do inversor não servem mais para nenhuma tarifa
+    if cached is None and any(entry['base'] is not base for entry in user_savings_cache.values()):
+        user_savings_cache.clear()
+
+    # Preço de cada intervalo obtido de uma vez, indexando a tabela de preços pelo array de postos
+    savings = base['energy'] * np.array(prices)[base['bands']]
+    cum_savings = np.concatenate(([0.0], np.cumsum(savings)))
+    user_savings_cache[prices] = {"base": base, "cum_savings": cum_savings}
+    return cum_savings
+
+def parse_tariff_price(value):
+    """
+    Converte um preço de tarifa (R$/kWh) para float, recusando valores negativos ou não finitos (NaN, infinito).
+    Raises:
+        ValueError: Se o preço for inválido.
+    """
+    price = float(value)
+    if not math.isfinite(price) or price < 0:
+        raise ValueError("Tarifa inválida")
+    return price
+
+def parse_date_arg(name):
+    """
+    Lê uma data ISO de um query parameter para as buscas por período.
+    Os horários do inversor não têm fuso (são a hora local da usina), então datas com fuso
+    (ex: 2025-09-01T00:00:00-03:00) são recusadas em vez de convertidas silenciosamente.
+    Args:
+        name (str): O nome do query parameter.
+    Returns:
+        datetime: A data sem fuso, ou None se o parâmetro não foi enviado.
+    Raises:
+        ValueError: Se a data for inválida ou tiver fuso horário.
+    """
+    value = request.args.get(name)
+    if not value: return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        raise ValueError(f"A data '{name}' não deve ter fuso horário")
+    return parsed
+
+def is_period_key(value, date_format):
+    """Verifica se um dia ('%Y-%m-%d') ou mês ('%Y-%m') está exatamente no formato usado no índice de períodos."""
+    try:
+        return datetime.strptime(value, date_format).strftime(date_format) == value
+    except ValueError:
+        return False
+
+def get_period_bounds(base, day=None, month=None, start=None, end=None):
+    """
+    Converte um dia, um mês ou um intervalo livre de datas nos índices [início, fim) dos arrays.
+    Dias e meses são consultados direto no índice pré-calculado; intervalos livres usam busca binária.
+    Args:
+        base (dict): O resultado de get_tariff_base().
+        day (str): Dia no formato 'AAAA-MM-DD'.
+        month (str): Mês no formato 'AAAA-MM'.
+        start, end (datetime): Início (inclusivo) e fim (exclusivo) de um intervalo livre.
+    Returns:
+        tuple: (início, fim). Um período sem dados retorna um intervalo vazio.
+    """
+    if day is not None:
+        return base['days'].get(day, (0, 0))
+    if month is not None:
+        return base['months'].get(month, (0, 0))
+    times = base['times']
+    lo = 0 if start is None else int(np.searchsorted(times, np.datetime64(start, 'ns'), side='left'))
+    hi = len(times) if end is None else int(np.searchsorted(times, np.datetime64(end, 'ns'), side='left'))
+    return lo, max(lo, hi)
+
+# --- DETECÇÃO DE ANOMALIAS E FALHAS DO INVERSOR ---
+
+NORMAL_WORKING_MODES = ('Normal', 'Check', 'Wait') # Check e Wait são os estados de partida/espera do inversor
+MAX_INVERTER_TEMPERATURE = 65.0 # °C. Acima disso o inversor começa a limitar a potência
+MPPT_MIN_POWER = 150.0 # W. Abaixo disso (amanhecer, entardecer) a comparação entre strings não faz sentido
+MPPT_MISMATCH_RATIO = 0.3 # Diferença relativa de potência entre as strings que indica um problema
+GENERATION_DROP_ZSCORE = -3.0 # Z-score da geração em relação à média histórica daquela hora
+GENERATION_MIN_EXPECTED = 300.0 # W. Só avalia quedas em horas em que se espera geração relevante
+GENERATION_MIN_SAMPLES = 30 # Leituras mínimas de uma hora do dia antes de confiar no seu perfil
+EWMA_ALPHA = 0.2 # Peso da leitura mais recente nas médias móveis exponenciais
+MAX_ALERTS = 200 # Quantidade máxima de alertas mantidos em memória
+
+# Texto exibido nas notificações do dashboard para cada tipo de alerta
+ALERT_MESSAGES = {
+    "fault": "Inversor em modo de falha ({value}).",
+    "overtemperature": "Temperatura do inversor elevada: {value:.1f} °C.",
+    "mppt_mismatch": "Diferença de {value:.0%} na potência entre as strings MPPT 1 e 2.",
+    "generation_drop": "Geração abaixo do esperado para o horário: {value:.0f} W."
+}
+
+class InverterAnomalyDetector:
+    """
+    Detector de anomalias que roda como uma etapa do carregamento dos dados do inversor.
+    Mantém estatísticas incrementais (médias por hora do dia, EWMA) para avaliar cada leitura nova
+    em O(1), e oferece um modo em lote (vetorizado) para processar o histórico de uma vez.
+    Um alerta é gerado apenas quando uma condição começa, e não a cada leitura em que ela continua.
+    """
+
+    def __init__(self):
+        self.alerts = deque(maxlen=MAX_ALERTS) # Alertas gerados, do mais antigo para o mais recente
+        self.last_time = None # Horário da última leitura processada
+        self.active = dict.fromkeys(ALERT_MESSAGES, False) # Quais condições estão ativas agora
+        self.power_ewma = None
+        self.mismatch_ewma = None
+        # Estatísticas da potência por hora do dia (algoritmo de Welford): [contagem, média, M2]
+        self.hour_stats = [[0, 0.0, 0.0] for _ in range(24)]
+
+    def backfill(self, df):
+        """
+        Processa um bloco de leituras de forma vetorizada e deixa o estado pronto para o modo incremental.
+        Args:
+            df (pandas.DataFrame): As leituras, em ordem cronológica.
+        """
+        if df.empty: return
+        power = df['Power(W)']
+        hours = df['Time'].dt.hour
+
+        # Média e desvio padrão de cada hora do dia usando apenas as leituras anteriores (como no modo incremental)
+        by_hour = power.groupby(hours)
+        count = by_hour.cumcount()
+        prior_sum = by_hour.cumsum() - power
+        prior_sq = (power ** 2).groupby(hours).cumsum() - power ** 2
+        expected = prior_sum / count.where(count > 0)
+        std = np.sqrt(((prior_sq - count * expected ** 2) / (count - 1).where(count > 1)).clip(lower=0))
+        power_ewma = power.ewm(alpha=EWMA_ALPHA, adjust=False).mean()
+        zscore = (power_ewma - expected) / std.where(std > 0)
+
+        # Diferença entre as strings, avaliada só quando há potência suficiente e as quatro medidas MPPT existem
+        string_power = [df[v] * df[i] for v, i in MPPT_COLS]
+        strongest = np.maximum(string_power[0], string_power[1])
+        complete = df[[col for pair in MPPT_COLS for col in pair]].notna().all(axis=1)
+        ratio = ((string_power[0] - string_power[1]).abs() / strongest).where(complete & (strongest >= MPPT_MIN_POWER))
+        mismatch_ewma = ratio.ewm(alpha=EWMA_ALPHA, adjust=False, ignore_na=True).mean()
+
+        temperature = df[TEMPERATURE_COL]
+        conditions = {
+            "fault": (~df[MODE_COL].isin(NORMAL_WORKING_MODES), df[MODE_COL]),
+            "overtemperature": (temperature > MAX_INVERTER_TEMPERATURE, temperature),
+            "mppt_mismatch": (ratio.notna() & (mismatch_ewma > MPPT_MISMATCH_RATIO), mismatch_ewma),
+            "generation_drop": ((count >= GENERATION_MIN_SAMPLES) & (expected >= GENERATION_MIN_EXPECTED)
+                                & (zscore < GENERATION_DROP_ZSCORE), power),
+        }
+        new_alerts = []
+        for kind, (mask, values) in conditions.items():
+            # Início de cada episódio: a condição é verdadeira agora e não era na leitura anterior
+            starts = mask & ~mask.shift(fill_value=self.active[kind])
+            new_alerts += [self.make_alert(kind, t, v) for t, v in zip(df['Time'][starts], values[starts])]
+            self.active[kind] = bool(mask.iloc[-1])
+        self.alerts.extend(sorted(new_alerts, key=lambda alert: alert['time']))
+
+        # Atualiza o estado incremental com o bloco inteiro
+        for hour, group in by_hour:
+            n, mean, m2 = self.hour_stats[hour]
+            g_n, g_mean, g_m2 = len(group), group.mean(), ((group - group.mean()) ** 2).sum()
+            total = n + g_n
+            delta = g_mean - mean
+            self.hour_stats[hour] = [total, mean + delta * g_n / total, m2 + g_m2 + delta ** 2 * n * g_n / total]
+        self.power_ewma = float(power_ewma.iloc[-1])
+        if mismatch_ewma.notna().any(): self.mismatch_ewma = float(mismatch_ewma.dropna().iloc[-1])
+        self.last_time = df['Time'].iloc[-1]
+
+    def update(self, reading):
+        """
+        Avalia uma única leitura nova em tempo constante e atualiza as estatísticas incrementais.
+        Args:
+            reading (dict): Uma linha dos dados do inversor.
+        """
+        power, hour = reading['Power(W)'], reading['Time'].hour
+
+        # Perfil esperado para a hora, calculado antes de incluir a leitura atual
+        count, expected, m2 = self.hour_stats[hour]
+        std = np.sqrt(m2 / (count - 1)) if count > 1 else 0.0
+        self.power_ewma = power if self.power_ewma is None else EWMA_ALPHA * power + (1 - EWMA_ALPHA) * self.power_ewma
+        zscore = (self.power_ewma - expected) / std if std > 0 else 0.0
+        # Welford: atualiza média e M2 com a leitura atual
+        delta = power - expected
+        new_mean = expected + delta / (count + 1)
+        self.hour_stats[hour] = [count + 1, new_mean, m2 + delta * (power - new_mean)]
+
+        # Leituras com alguma medida MPPT faltando (NaN) não entram na comparação entre strings, como no modo em lote
+        mppt_values = [reading.get(col) for pair in MPPT_COLS for col in pair]
+        complete = not any(pd.isna(value) for value in mppt_values)
+        string_power = [mppt_values[0] * mppt_values[1], mppt_values[2] * mppt_values[3]] if complete else [0, 0]
+        strongest = max(string_power)
+        mismatch = False
+        if complete and strongest >= MPPT_MIN_POWER:
+            ratio = abs(string_power[0] - string_power[1]) / strongest
+            self.mismatch_ewma = ratio if self.mismatch_ewma is None else EWMA_ALPHA * ratio + (1 - EWMA_ALPHA) * self.mismatch_ewma
+            mismatch = self.mismatch_ewma > MPPT_MISMATCH_RATIO
+
+        temperature = reading.get(TEMPERATURE_COL)
+        conditions = {
+            "fault": (reading.get(MODE_COL) not in NORMAL_WORKING_MODES, reading.get(MODE_COL)),
+            "overtemperature": (temperature is not None and temperature > MAX_INVERTER_TEMPERATURE, temperature),
+            "mppt_mismatch": (mismatch, self.mismatch_ewma),
+            "generation_drop": (count >= GENERATION_MIN_SAMPLES and expected >= GENERATION_MIN_EXPECTED
+                                and zscore < GENERATION_DROP_ZSCORE, power),
+        }
+        for kind, (is_active, value) in conditions.items():
+            if is_active and not self.active[kind]:
+                self.alerts.append(self.make_alert(kind, reading['Time'], value))
+            self.active[kind] = bool(is_active)
+        self.last_time = reading['Time']
+
+    @staticmethod
+    def make_alert(kind, time, value):
+        """Monta o alerta no formato usado pelas notificações do dashboard."""
+        return {
+            "kind": kind,
+            "type": "warn",
+            "time": pd.Timestamp(time).isoformat(),
+            "text": ALERT_MESSAGES[kind].format(value=value)
+        }
+
+# Instância única do detector, alimentada a cada carga dos dados do inversor
+anomaly_detector = InverterAnomalyDetector()
+# Várias requisições podem recarregar os dados ao mesmo tempo; a trava garante que cada leitura seja avaliada uma única vez
+anomaly_lock = threading.Lock()
+
+def run_anomaly_detection(df):
+    """
+    Etapa do pipeline de carga: na primeira execução processa todo o histórico em lote;
+    nas seguintes, avalia uma a uma apenas as leituras mais novas que a última já processada.
+    Args:
+        df (pandas.DataFrame): Os dados do inversor recém-carregados.
+    """
+    try:
+        with anomaly_lock:
+            if anomaly_detector.last_time is None:
+                anomaly_detector.backfill(df)
+            else:
+                for reading in df[df['Time'] > anomaly_detector.last_time].to_dict(orient='records'):
+                    anomaly_detector.update(reading)
+    except Exception as e:
+        # A detecção nunca deve impedir que os dados do inversor sejam servidos
+        print(f"ERRO na detecção de anomalias: {e}")
+
+# --- EXPORTAÇÃO DE DADOS EM BLOCOS ---
+
+EXPORT_CHUNK_ROWS = 5000 # Linhas serializadas por vez, para manter a memória limitada em períodos longos
+# Formatos de exportação suportados: extensão do arquivo -> tipo de conteúdo (MIME)
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "jsonl": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet"
+}
+
+class StreamSink:
+    """
+    Arquivo em memória para o escritor de Parquet: guarda apenas os bytes ainda não enviados,
+    mas continua informando a posição absoluta, que o Parquet usa no rodapé do arquivo.
+    """
+
+    def __init__(self):
+        self.buffer = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        """Retorna e descarta os bytes acumulados desde a última chamada."""
+        data = b''.join(self.buffer)
+        self.buffer = []
+        return data
+
+def iter_export_chunks(df, lo, hi, columns):
+    """
+    Percorre as linhas [lo, hi) dos dados do inversor em blocos de EXPORT_CHUNK_ROWS linhas.
+    Args:
+        df (pandas.DataFrame): Os dados do inversor.
+        lo, hi (int): O intervalo de linhas a exportar.
+        columns (list): As colunas a incluir.
+    Yields:
+        pandas.DataFrame: Cada bloco, já com as colunas selecionadas.
+    """
+    for start in range(lo, hi, EXPORT_CHUNK_ROWS):
+        yield df.iloc[start:min(start + EXPORT_CHUNK_ROWS, hi)][columns]
+
+def stream_csv(chunks, empty_frame):
+    """
+    Serializa os blocos em CSV. O cabeçalho sai primeiro, a partir de um DataFrame vazio,
+    para que um período sem leituras ainda gere um CSV válido.
+    """
+    yield empty_frame.to_csv(index=False)
+    for chunk in chunks:
+        yield chunk.to_csv(index=False, header=False, date_format='%Y-%m-%d %H:%M:%S')
+
+def stream_jsonl(chunks):
+    """Serializa os blocos em JSON delimitado por linhas (um objeto por leitura)."""
+    for chunk in chunks:
+        if chunk.empty: continue
+        yield chunk.to_json(orient='records', lines=True, date_format='iso', force_ascii=False).rstrip('\n') + '\n'
+
+def stream_parquet(chunks, empty_frame):
+    """
+    Serializa os blocos em Parquet, um row group por bloco, enviando os bytes assim que cada um é escrito.
+    Args:
+        chunks: Os blocos gerados por iter_export_chunks().
+        empty_frame (pandas.DataFrame): Um DataFrame vazio com as colunas exportadas, usado para o esquema.
+    """
+    sink = StreamSink()
+    schema = pa.Schema.from_pandas(empty_frame, preserve_index=False)
+    with pq.ParquetWriter(sink, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            yield sink.drain()
+    yield sink.drain() # Rodapé do arquivo, escrito ao fechar o escritor
+
+# --- OPERAÇÕES COM DISPOSITIVOS ---
+
+# Potência (W) simulada de um dispositivo ligado, de acordo com o seu tipo
+DEVICE_WATTS = {"appliance": 200, "climate": 900}
+DEFAULT_DEVICE_WATTS = 60
+# Campos que podem ser usados como seletor em operações em lote (comparados sem diferenciar maiúsculas)
+DEVICE_SELECTORS = ('name', 'room', 'type')
+
+def set_device_state(device, on):
+    """Liga ou desliga um dispositivo, atualizando também a potência simulada."""
+    device['on'] = on
+    device['watts'] = on * DEVICE_WATTS.get(device['type'], DEFAULT_DEVICE_WATTS)
+
+def add_cost_per_hour(devices, user_tariff):
+    """Calcula o custo por hora (R$) de cada dispositivo com a tarifa do usuário."""
+    for device in devices:
+        device['cost_per_hour'] = (device.get('watts', 0) / 1000) * user_tariff
+    return devices
+
+def apply_device_changes(user_devices, changes):
+    """
+    Aplica uma lista de alterações de estado aos dispositivos de um usuário (em memória).
+    Cada alteração tem o estado alvo 'on' e escolhe os dispositivos por 'ids' (lista de IDs)
+    e/ou por seletores de DEVICE_SELECTORS (ex: {"room": "Sala", "on": false}).
+    Args:
+        user_devices (list): Os dispositivos do usuário, alterados no lugar.
+        changes (list): As alterações a aplicar, em ordem.
+    Returns:
+        list: Os dispositivos que foram alterados (sem repetição).
+    Raises:
+        ValueError: Se alguma alteração não tiver estado alvo ou nenhum critério de seleção.
+    """
+    changed = {}
+    for change in changes:
+        if not isinstance(change, dict) or not isinstance(change.get('on'), bool):
+            raise ValueError("Cada alteração precisa do estado 'on' (true ou false).")
+        ids = change.get('ids')
+        if ids is not None and not isinstance(ids, list):
+            raise ValueError("'ids' deve ser uma lista de IDs.")
+        selectors = {field: str(change[field]).lower() for field in DEVICE_SELECTORS if change.get(field)}
+        if not ids and not selectors:
+            raise ValueError("Cada alteração precisa de 'ids' ou de um seletor (name, room ou type).")
+        for device in user_devices:
+            if ids and device['id'] not in ids: continue
+            if any(str(device.get(field, '')).lower() != value for field, value in selectors.items()): continue
+            set_device_state(device, change['on'])
+            changed[device['id']] = device
+    return list(changed.values())
+
 # --- ROTAS DA API (ENDPOINTS) ---
 # Cada função abaixo corresponde a uma URL da API (ex: /api/register)
 # e define o que o servidor deve fazer quando essa URL é acessada.
@@ -175,7 +918,7 @@ def register_user():
     users_db[email] = {
         "name": name, "email": email, "password": generate_password_hash(password), 
         "plan": "Starter", "theme": "padrão", "colorTheme": "dark", 
-        "tariff": 0.95, "savingsGoal": 500, "notifications": "enabled" 
+        "tariff": DEFAULT_TARIFF, "savingsGoal": 500, "notifications": "enabled" 
     }
     write_json_file(USERS_FILE, users_db) # Salva as alterações no arquivo
     
@@ -206,7 +949,7 @@ def login_user():
     # Lógica para garantir que usuários antigos tenham os campos mais novos (compatibilidade)
     needs_update = False
     if 'tariff' not in user:
-        user['tariff'] = 0.95
+        user['tariff'] = DEFAULT_TARIFF
         needs_update = True
     if 'savingsGoal' not in user:
         user['savingsGoal'] = 500
@@ -257,7 +1000,7 @@ def get_kpis():
     if df is None or df.empty: return jsonify({"error": "Não foi possível carregar os dados do inversor"}), 500
     
     users_db = read_json_file(USERS_FILE, {})
-    user_tariff = users_db.get(user_email, {}).get('tariff', 0.95) # Pega a tarifa do usuário ou usa um padrão
+    user = users_db.get(user_email, {}) # Tarifas do usuário (ou as tarifas padrão, se ele não existir)
 
     # Calcula a geração de hoje
     latest_date_in_data = df['Time'].max().date() # Encontra a data mais recente nos dados
@@ -272,13 +1015,10 @@ def get_kpis():
     # Consumo da casa é simulado com um valor aleatório para fins de demonstração
     house_load_kwh = 0.53
 
-    # Calcula a economia do mês atual
-    savings_this_month = 0
-    now = datetime.now()
-    month_data = df[(df['Time'].dt.month == now.month) & (df['Time'].dt.year == now.year)]
-    if not month_data.empty:
-        generation_this_month = month_data['Total Generation(kWh)'].max() - month_data['Total Generation(kWh)'].min()
-        savings_this_month = generation_this_month * user_tariff
+    # Calcula a economia do mês atual com duas leituras na soma acumulada de economia do usuário
+    cum_savings = get_user_cum_savings(df, user)
+    lo, hi = get_period_bounds(get_tariff_base(df), month=datetime.now().strftime('%Y-%m'))
+    savings_this_month = float(cum_savings[hi] - cum_savings[lo])
 
     return jsonify({
         "todayGenKwh": generation_today, 
@@ -287,10 +1027,67 @@ def get_kpis():
         "savingsThisMonth": savings_this_month
     })
 
+@app.route('/api/savings', methods=['GET'])
+def get_savings():
+    """
+    Endpoint para consultar a geração e a economia de um período.
+    Recebe: 'email' e um dos filtros como query parameter: 'day' (AAAA-MM-DD), 'month' (AAAA-MM)
+            ou 'start'/'end' (datas ISO; o fim não é incluído). Sem filtro, usa todo o histórico.
+    Retorna: JSON com a geração (kWh), a economia (R$) e a geração separada por posto tarifário.
+    """
+    user_email = request.args.get('email')
+    if not user_email: return jsonify({"error": "E-mail do usuário é necessário"}), 400
+
+    df = get_inverter_data()
+    if df is None or df.empty: return jsonify({"error": "Não foi possível carregar os dados do inversor"}), 500
+
+    try:
+        start, end = parse_date_arg('start'), parse_date_arg('end')
+    except ValueError:
+        return jsonify({"error": "Datas inválidas. Use o formato AAAA-MM-DD, sem fuso horário."}), 400
+    day, month = request.args.get('day'), request.args.get('month')
+    if day is not None and not is_period_key(day, '%Y-%m-%d'):
+        return jsonify({"error": "Dia inválido. Use o formato AAAA-MM-DD."}), 400
+    if month is not None and not is_period_key(month, '%Y-%m'):
+        return jsonify({"error": "Mês inválido. Use o formato AAAA-MM."}), 400
+
+    users_db = read_json_file(USERS_FILE, {})
+    base = get_tariff_base(df)
+    cum_savings = get_user_cum_savings(df, users_db.get(user_email, {}))
+    lo, hi = get_period_bounds(base, day=day, month=month, start=start, end=end)
+
+    cum_by_band = base['cum_energy_by_band']
+    return jsonify({
+        "generationKwh": float(base['cum_energy'][hi] - base['cum_energy'][lo]),
+        "savings": float(cum_savings[hi] - cum_savings[lo]),
+        "generationByBandKwh": {band: float(cum_by_band[i, hi] - cum_by_band[i, lo]) for i, band in enumerate(TARIFF_BANDS)}
+    })
+
+@app.route('/api/alerts', methods=['GET'])
+def get_alerts():
+    """
+    Endpoint para as notificações do dashboard.
+    Recebe: como query parameters (opcionais), 'limit' com o máximo de alertas a retornar e
+            'since' (data ISO) para retornar apenas os alertas posteriores a esse horário.
+    Retorna: Os alertas mais recentes do detector de anomalias, do mais novo para o mais antigo.
+    """
+    try:
+        limit = int(request.args.get('limit', 10))
+        since = parse_date_arg('since')
+    except ValueError:
+        return jsonify({"error": "Parâmetros inválidos: 'limit' deve ser inteiro e 'since' uma data ISO sem fuso horário"}), 400
+    get_inverter_data() # Garante que as leituras mais novas já passaram pelo detector
+    # Copia os alertas sob a trava: o detector pode estar acrescentando alertas em outra thread
+    with anomaly_lock:
+        snapshot = list(anomaly_detector.alerts)
+    alerts = [alert for alert in reversed(snapshot) if since is None or datetime.fromisoformat(alert['time']) > since]
+    return jsonify(alerts[:max(limit, 0)])
+
 @app.route('/api/generation/history', methods=['GET'])
 def get_generation_history():
     """
     Endpoint para o gráfico de histórico de geração do dia.
+    Recebe: 'layout=columnar' (opcional) como query parameter, para o formato colunar compacto.
     Retorna: Dados de geração de energia (kW) por hora para o dia mais recente disponível nos dados.
     """
     df = get_inverter_data()
@@ -311,6 +1108,9 @@ def get_generation_history():
     full_period_index = pd.date_range(start=start_time, periods=24, freq='h')
     hourly_generation = hourly_generation.reindex(full_period_index, fill_value=0)
 
+    if request.args.get('layout') == 'columnar':
+        return jsonify(to_columnar(hourly_generation.index, generation_kw=(hourly_generation / 1000).round(2).tolist()))
+
     return jsonify({
         "labels": hourly_generation.index.strftime('%Hh').tolist(), # Labels para o eixo X (ex: "01h", "02h")
         "generation_kw": (hourly_generation / 1000).round(2).tolist() # Dados para o eixo Y, convertidos para kW
@@ -321,26 +1121,76 @@ def get_monthly_report():
     """
     Endpoint para o relatório de geração mensal.
     Processa um arquivo CSV específico para relatórios mensais.
-    Retorna: Uma lista de objetos, cada um com 'date' e 'generation'.
+    Recebe: 'layout=columnar' (opcional) como query parameter.
+    Retorna: Uma lista de objetos, cada um com 'date' (MM.AAAA) e 'generation', ou, no layout colunar,
+             o mesmo formato de to_columnar(): 't0' no primeiro dia do primeiro mês e 'dt' com os deltas
+             (em segundos) até o primeiro dia de cada mês seguinte, em paralelo com 'generation'.
     """
     if not MONTHLY_DATA_FILE: return jsonify({"error": "Arquivo de relatório mensal não configurado."}), 500
     try:
         # Lê o arquivo de relatório, pulando cabeçalho e rodapé
-        df = pd.read_csv(MONTHLY_DATA_FILE, delimiter=';', skiprows=20, encoding='latin1', skipfooter=1, engine='python')
+        # A coluna 'Date' (MM.AAAA) é lida como texto para não virar um número decimal (ex: 01.2025 -> 1.2025)
+        df = pd.read_csv(MONTHLY_DATA_FILE, delimiter=';', skiprows=20, encoding='latin1', skipfooter=1, engine='python', dtype={'Date': str})
         df.rename(columns={'Generation(kWh)': 'generation', 'Date': 'date'}, inplace=True)
         df['generation'] = pd.to_numeric(df['generation'].astype(str).str.replace(',', '.'), errors='coerce')
         df.dropna(subset=['date', 'generation'], inplace=True)
+        if request.args.get('layout') == 'columnar':
+            months = pd.DatetimeIndex(pd.to_datetime(df['date'], format='%m.%Y'))
+            return jsonify(to_columnar(months, generation=df['generation'].tolist()))
         report_data = df[['date', 'generation']].to_dict(orient='records')
         return jsonify(report_data)
     except Exception as e:
         return jsonify({"error": f"Erro ao processar arquivo de relatório: {e}"}), 500
 
+@app.route('/api/export', methods=['GET'])
+def export_data():
+    """
+    Endpoint para exportar os dados brutos do inversor.
+    Os dados são enviados em blocos à medida que são serializados, então períodos longos
+    não precisam ser montados inteiros em memória.
+    Recebe: como query parameters, 'start' e 'end' (datas ISO; o fim não é incluído),
+            'format' ('csv', 'jsonl' ou 'parquet') e 'columns' (opcional, nomes separados por vírgula).
+    Retorna: O arquivo no formato pedido, como download.
+    """
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Formato inválido. Use um de: {', '.join(EXPORT_FORMATS)}."}), 400
+    if export_format == 'parquet' and pa is None:
+        return jsonify({"error": "Exportação em Parquet indisponível: instale o pacote 'pyarrow'."}), 501
+
+    df = get_inverter_data()
+    if df is None or df.empty: return jsonify({"error": "Não foi possível carregar os dados do inversor"}), 500
+
+    try:
+        start, end = parse_date_arg('start'), parse_date_arg('end')
+    except ValueError:
+        return jsonify({"error": "Datas inválidas. Use o formato AAAA-MM-DD, sem fuso horário."}), 400
+
+    # Projeção de colunas: só as colunas pedidas são serializadas
+    columns = [col.strip() for col in request.args['columns'].split(',')] if request.args.get('columns') else list(df.columns)
+    unknown_columns = [col for col in columns if col not in df.columns]
+    if unknown_columns:
+        return jsonify({"error": f"Colunas desconhecidas: {', '.join(unknown_columns)}"}), 400
+
+    lo, hi = get_period_bounds(get_tariff_base(df), start=start, end=end)
+    chunks = iter_export_chunks(df, lo, hi, columns)
+    if export_format == 'csv':
+        body = stream_csv(chunks, df.iloc[0:0][columns])
+    elif export_format == 'jsonl':
+        body = stream_jsonl(chunks)
+    else:
+        body = stream_parquet(chunks, df.iloc[0:0][columns])
+
+    return Response(body, mimetype=EXPORT_FORMATS[export_format], headers={
+        "Content-Disposition": f"attachment; filename=goodenergy_export.{export_format}"
+    })
+
 @app.route('/api/devices', methods=['GET'])
 def get_devices():
     """
     Endpoint para listar os dispositivos de um usuário.
     Recebe: 'email' como query parameter.
-    Retorna: Lista de dispositivos do usuário, com o custo por hora já calculado.
+    Retorna: Lista de dispositivos do usuário, com o custo por hora (R$) já calculado.
     """
     user_email = request.args.get('email')
     if not user_email: return jsonify({"error": "E-mail do usuário é necessário"}), 400
@@ -348,14 +1198,10 @@ def get_devices():
     devices_db = read_json_file(DEVICES_FILE, {})
     users_db = read_json_file(USERS_FILE, {})
     user_devices = devices_db.get(user_email, [])
-    user_tariff = users_db.get(user_email, {}).get('tariff', 0.95)
+    user_tariff = users_db.get(user_email, {}).get('tariff', DEFAULT_TARIFF)
     
-    # Calcula o custo por hora para cada dispositivo antes de enviar para o frontend
-    for device in user_devices:
-        cost_per_hour = (device.get('watts', 0) / 1000) * user_tariff
-        device['cost_per_hour'] = f"R$ {cost_per_hour:.2f}"
-
-    return jsonify(user_devices)
+    # Calcula o custo por hora para cada dispositivo antes de enviar para o frontend (a formatação em R$ é feita lá)
+    return jsonify(add_cost_per_hour(user_devices, user_tariff))
 
 @app.route('/api/devices', methods=['POST'])
 def add_device():
@@ -371,7 +1217,7 @@ def add_device():
     user_devices = devices_db.get(user_email, [])
     # Cria o novo dispositivo com um ID único
     new_device = {"id": str(uuid.uuid4()), "name": name, "room": room, "type": type, "on": False, "watts": 0}
-    new_device['cost_per_hour'] = "R$ 0.00"
+    new_device['cost_per_hour'] = 0.0
     user_devices.append(new_device)
     devices_db[user_email] = user_devices
     write_json_file(DEVICES_FILE, devices_db)
@@ -392,9 +1238,8 @@ def toggle_device(device_id):
     device_found = False
     for device in user_devices:
         if device['id'] == device_id:
-            device['on'] = new_state
-            # Atribui uma potência (watts) simulada baseada no tipo e estado do dispositivo
-            device['watts'] = device['on'] * (200 if device['type'] == 'appliance' else 900 if device['type'] == 'climate' else 60)
+            # Atualiza o estado e a potência (watts) simulada baseada no tipo do dispositivo
+            set_device_state(device, new_state)
             device_found = True
             break
     if not device_found: return jsonify({"error": "Dispositivo não encontrado"}), 404
@@ -402,6 +1247,35 @@ def toggle_device(device_id):
     write_json_file(DEVICES_FILE, devices_db)
     return jsonify({"message": "Dispositivo atualizado"})
 
+@app.route('/api/devices', methods=['PATCH'])
+def update_devices_batch():
+    """
+    Endpoint para ligar ou desligar vários dispositivos de uma vez.
+    Todas as alterações são aplicadas com uma única leitura e uma única escrita do arquivo de dispositivos.
+    Recebe: JSON com 'email' e 'changes', uma lista de alterações como
+            {"ids": ["..."], "on": true} ou {"room": "Sala", "type": "climate", "on": false}.
+            Para uma única alteração, os campos podem vir direto no corpo, sem 'changes'.
+    Retorna: A lista atualizada de dispositivos do usuário, com o custo por hora.
+    """
+    data = request.get_json()
+    user_email = data.get('email')
+    changes = data.get('changes', [{key: value for key, value in data.items() if key != 'email'}])
+    if not user_email or not isinstance(changes, list) or not changes:
+        return jsonify({"error": "Faltam dados para atualizar os dispositivos"}), 400
+
+    devices_db = read_json_file(DEVICES_FILE, {})
+    user_devices = devices_db.get(user_email, [])
+    try:
+        changed = apply_device_changes(user_devices, changes)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if not changed: return jsonify({"error": "Nenhum dispositivo corresponde aos critérios"}), 404
+
+    devices_db[user_email] = user_devices
+    write_json_file(DEVICES_FILE, devices_db)
+    users_db = read_json_file(USERS_FILE, {})
+    return jsonify(add_cost_per_hour(user_devices, users_db.get(user_email, {}).get('tariff', DEFAULT_TARIFF)))
+
 @app.route('/api/devices/<string:device_id>', methods=['DELETE'])
 def delete_device(device_id):
     """
@@ -486,8 +1360,8 @@ def ask_agent():
     Endpoint principal de interação com o agente de IA (Gemini).
     Recebe: JSON com a 'question' e o 'email' do usuário.
     Processa a pergunta:
-    - Se for um comando para controlar um dispositivo, a IA retorna um JSON específico.
-      O backend executa o comando e retorna uma confirmação.
+    - Se for um comando para controlar um ou mais dispositivos (ex: "desligar tudo da sala"), a IA
+      retorna um JSON com a lista de ações. O backend executa todas com uma única escrita e retorna uma confirmação.
     - Se for qualquer outra pergunta, a IA responde em texto (Markdown), e o backend
       repassa essa resposta para o frontend.
     """
@@ -501,12 +1375,13 @@ def ask_agent():
         # Fornece à IA o contexto dos dispositivos que o usuário possui
         devices_db = read_json_file(DEVICES_FILE, {})
         user_devices = devices_db.get(user_email, [])
-        device_names = [d['name'] for d in user_devices]
+        device_list = [f"{d['name']} (cômodo: {d['room']}, tipo: {d['type']})" for d in user_devices]
         
         # O "prompt" é a instrução que damos à IA.
         # Ele define o comportamento esperado e fornece os dados necessários.
-        prompt = f"""Você é um assistente de casa inteligente. Analise o pedido do usuário. Os dispositivos disponíveis são: {', '.join(device_names)}.
-                - Se o pedido for um comando para ligar, desligar, acender ou apagar um dispositivo, responda APENAS com um JSON no formato: {{"command": true, "device_name": "nome do dispositivo", "action": "on" ou "off"}}
+        prompt = f"""Você é um assistente de casa inteligente. Analise o pedido do usuário. Os dispositivos disponíveis são: {', '.join(device_list)}.
+                - Se o pedido for um comando para ligar, desligar, acender ou apagar um ou mais dispositivos, responda APENAS com um JSON no formato: {{"command": true, "actions": [{{"device_name": "nome do dispositivo", "action": "on" ou "off"}}]}}
+                  Para vários dispositivos de um mesmo cômodo ou tipo (ex: "desligar tudo da sala"), use uma ação com "room" ou "type" no lugar de "device_name": {{"room": "nome do cômodo", "action": "off"}}
                 - Se for qualquer outra pergunta, responda normalmente em Markdown.
 
                 Pedido do usuário: "{question}"
@@ -519,25 +1394,31 @@ def ask_agent():
             # Tenta interpretar a resposta da IA como um JSON de comando
             potential_command = json.loads(response_text)
             if isinstance(potential_command, dict) and potential_command.get("command"):
-                device_name = potential_command.get("device_name")
-                action = potential_command.get("action")
-                
-                # Procura o dispositivo mencionado na lista de dispositivos do usuário
-                target_device = next((d for d in user_devices if d['name'].lower() == device_name.lower()), None)
-
-                if not target_device:
-                    return jsonify({"answer": f"Não encontrei um dispositivo chamado '{device_name}'."})
+                # Aceita tanto a lista de ações quanto o formato antigo, com um único dispositivo
+                actions = potential_command.get("actions") or [potential_command]
+                # Descarta ações malformadas (sem alvo ou sem "on"/"off") para não perder as válidas do mesmo comando
+                valid_actions = [
+                    a for a in actions
+                    if isinstance(a, dict) and a.get("action") in ('on', 'off') and any(a.get(key) for key in ('device_name', 'room', 'type'))
+                ]
+                if not valid_actions:
+                    return jsonify({"answer": "Não entendi quais dispositivos devem ser ligados ou desligados."})
+                changes = [
+                    {"name": a.get("device_name"), "room": a.get("room"), "type": a.get("type"), "on": a["action"] == 'on'}
+                    for a in valid_actions
+                ]
                 
-                # Executa a ação (liga/desliga)
-                new_state = (action == 'on')
-                target_device['on'] = new_state
-                target_device['watts'] = new_state * (200 if target_device['type'] == 'appliance' else 900 if target_device['type'] == 'climate' else 60)
+                # Executa todas as ações (liga/desliga) em memória, com uma única escrita no final
+                changed = apply_device_changes(user_devices, changes)
+                if not changed:
+                    targets = ', '.join(str(a.get("device_name") or a.get("room") or a.get("type")) for a in valid_actions)
+                    return jsonify({"answer": f"Não encontrei um dispositivo correspondente a '{targets}'."})
                 
                 devices_db[user_email] = user_devices
                 write_json_file(DEVICES_FILE, devices_db)
 
-                action_text = "ligado" if new_state else "desligado"
-                return jsonify({"answer": f"Ok, dispositivo '{target_device['name']}' foi {action_text}."})
+                summary = ', '.join(f"'{d['name']}' foi {'ligado' if d['on'] else 'desligado'}" for d in changed)
+                return jsonify({"answer": f"Ok, {summary}."})
 
         except (json.JSONDecodeError, TypeError):
             # Se a resposta não for um JSON de comando, a trata como uma resposta de texto normal.
@@ -577,6 +1458,7 @@ def save_preferences():
     data = request.get_json()
     email = data.get('email')
     tariff = data.get('tariff')
+    tariff_schedule = data.get('tariffSchedule')
     savings_goal = data.get('savingsGoal')
     notifications = data.get('notifications')
 
@@ -587,12 +1469,22 @@ def save_preferences():
         try:
             # Atualiza apenas os campos que foram enviados
             if tariff is not None:
-                users_db[email]['tariff'] = float(tariff)
+                users_db[email]['tariff'] = parse_tariff_price(tariff)
+            if tariff_schedule is not None:
+                # Tarifas por posto (ex: {"peak": 1.5, "offPeak": 0.7}). Postos omitidos usam a tarifa única.
+                if not isinstance(tariff_schedule, dict) or not set(tariff_schedule) <= set(TARIFF_BANDS):
+                    raise ValueError("Postos tarifários inválidos")
+                users_db[email]['tariffSchedule'] = {band: parse_tariff_price(price) for band, price in tariff_schedule.items()}
             if savings_goal is not None:
                 users_db[email]['savingsGoal'] = int(savings_goal)
             if notifications is not None:
                 users_db[email]['notifications'] = notifications
             write_json_file(USERS_FILE, users_db)
+            # Descarta do cache as tarifas que nenhum usuário usa mais; as dos outros usuários continuam valendo
+            if tariff is not None or tariff_schedule is not None:
+                prices_in_use = {get_user_tariff_prices(user) for user in users_db.values()}
+                for prices in set(user_savings_cache) - prices_in_use:
+                    user_savings_cache.pop(prices, None)
             
             updated_user = users_db[email].copy()
             del updated_user['password']
@@ -782,6 +1674,36 @@ def save_chat_history():
     write_json_file(CHAT_HISTORY_FILE, all_histories)
     return jsonify({"message": "Histórico salvo com sucesso."})
 
+@app.route('/api/admin/profiles', methods=['GET'])
+def get_profiles():
+    """
+    Endpoint para listar as capturas do profiling sob demanda.
+    Recebe: O cabeçalho 'X-Profile-Token' com o token de administrador.
+    Retorna: Lista com nome, tamanho (bytes) e data de cada captura, da mais recente para a mais antiga.
+    """
+    if not PROFILE_ADMIN_TOKEN: return jsonify({"error": "Profiling não configurado."}), 404
+    if not is_profile_admin(request): return jsonify({"error": "Token de administrador inválido."}), 403
+    profiles = []
+    for name in reversed(list_profiles()):
+        path = os.path.join(PROFILE_DIR, name)
+        try:
+            profiles.append({"name": name, "size": os.path.getsize(path), "created": datetime.fromtimestamp(os.path.getmtime(path)).isoformat()})
+        except FileNotFoundError:
+            continue # Apagada pelo anel de capturas enquanto a lista era montada
+    return jsonify(profiles)
+
+@app.route('/api/admin/profiles/<string:name>', methods=['GET'])
+def download_profile(name):
+    """
+    Endpoint para baixar uma captura do profiling.
+    Recebe: O nome da captura na URL e o cabeçalho 'X-Profile-Token'.
+    Retorna: O arquivo .prof (abrir com pstats/snakeviz) ou .collapsed (entrada para flamegraph).
+    """
+    if not PROFILE_ADMIN_TOKEN: return jsonify({"error": "Profiling não configurado."}), 404
+    if not is_profile_admin(request): return jsonify({"error": "Token de administrador inválido."}), 403
+    if name not in list_profiles(): return jsonify({"error": "Captura não encontrada."}), 404
+    return send_from_directory(PROFILE_DIR, name, as_attachment=True)
+
 # --- EXECUÇÃO DA APLICAÇÃO ---
 
 # Este bloco só será executado se o script `app.py` for rodado diretamente.
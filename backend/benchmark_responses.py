@@ -0,0 +1,105 @@
+# --- BENCHMARK DA CODIFICAÇÃO DAS RESPOSTAS ---
+# Compara, para os endpoints com mais dados, o tamanho das respostas (bytes enviados pela rede)
+# e o tempo de CPU da serialização, antes e depois da codificação compacta:
+# - Antes: codificador JSON padrão do Flask, sem compressão, layout em lista de objetos.
+# - Depois: CompactJSONProvider (floats de precisão fixa), gzip/brotli e layout colunar quando disponível.
+#
+# O conteúdo de cada endpoint é capturado uma vez, e o tempo medido é só o de app.json.response()
+# (mais a compressão, no cenário "depois"), sem o processamento das rotas nem o overhead do werkzeug.
+# Atenção: o cenário "antes" usa as rotas atuais, então já inclui mudanças que não são do codificador,
+# como o 'cost_per_hour' numérico em /api/devices (antes era o texto "R$ 0.00") e a coluna 'date' do
+# relatório mensal lida como texto ("01.2025" em vez de 1.2025).
+#
+# Como rodar (na pasta backend):
+# python benchmark_responses.py
+
+import json  # Para montar o arquivo temporário de dispositivos do usuário grande
+import os  # Para apagar o arquivo temporário ao final
+import tempfile  # Arquivo de dispositivos separado, para não alterar data/dispositivos.json
+import time  # Para medir o tempo de CPU de cada rodada
+from flask.json.provider import DefaultJSONProvider
+
+import app as good_energy  # A aplicação Flask deste projeto
+
+ITERATIONS = 2000 # Quantidade de serializações por endpoint em cada cenário
+USER_EMAIL = 'goodenergy@dev.com.br' # Usuário de exemplo presente em data/users.json
+LARGE_USER_EMAIL = 'benchmark@goodenergy.dev' # Usuário fictício com muitos dispositivos
+LARGE_USER_DEVICES = 60 # Suficiente para a resposta passar de COMPRESSION_MIN_BYTES e ser comprimida
+
+# Endpoints medidos: (rótulo, URL no formato antigo, URL no formato novo)
+ENDPOINTS = [
+    ("kpis", f"/api/kpis?email={USER_EMAIL}", f"/api/kpis?email={USER_EMAIL}"),
+    ("generation/history", "/api/generation/history", "/api/generation/history?layout=columnar"),
+    ("reports/monthly", "/api/reports/monthly", "/api/reports/monthly?layout=columnar"),
+    ("devices", f"/api/devices?email={USER_EMAIL}", f"/api/devices?email={USER_EMAIL}"),
+    ("savings", f"/api/savings?email={USER_EMAIL}", f"/api/savings?email={USER_EMAIL}"),
+    ("devices (60)", f"/api/devices?email={LARGE_USER_EMAIL}", f"/api/devices?email={LARGE_USER_EMAIL}"),
+]
+
+def use_large_devices_file():
+    """
+    Aponta a aplicação para um arquivo de dispositivos temporário com um usuário grande,
+    para que ao menos uma resposta medida passe pelo caminho de compressão.
+    Returns:
+        str: O caminho do arquivo temporário (apagado por quem chamou).
+    """
+    with open(good_energy.DEVICES_FILE, 'r', encoding='utf-8') as f:
+        devices_db = json.load(f)
+    rooms, types = ['sala', 'cozinha', 'quarto', 'escritorio'], ['appliance', 'climate', 'other']
+    devices_db[LARGE_USER_EMAIL] = [
+        {"id": f"bench-{i}", "name": f"Dispositivo {i}", "room": rooms[i % len(rooms)], "type": types[i % len(types)],
+         "on": i % 2 == 0, "watts": 200 if i % 2 == 0 else 0}
+        for i in range(LARGE_USER_DEVICES)
+    ]
+    fd, path = tempfile.mkstemp(suffix='.json')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump(devices_db, f)
+    good_energy.DEVICES_FILE = path
+    return path
+
+def capture_payload(client, url):
+    """
+    Chama o endpoint uma vez e devolve o conteúdo da resposta como objeto Python, com os floats
+    completos (o provedor padrão não arredonda), para ser serializado pelos dois codificadores.
+    """
+    response = client.get(url, headers={"Accept-Encoding": "identity"})
+    return response.get_json()
+
+def measure(provider, payload, encoding=None):
+    """
+    Serializa o conteúdo ITERATIONS vezes com o provedor JSON e, se 'encoding' for informado,
+    comprime o corpo como o compress_response faria (só acima de COMPRESSION_MIN_BYTES).
+    Returns:
+        tuple: (bytes enviados pela rede, microssegundos de CPU por serialização)
+    """
+    with good_energy.app.app_context():
+        start = time.process_time()
+        for _ in range(ITERATIONS):
+            data = provider.response(payload).get_data()
+            if encoding is not None and len(data) >= good_energy.COMPRESSION_MIN_BYTES:
+                data = good_energy.compress_data(data, encoding)
+        cpu_us = (time.process_time() - start) / ITERATIONS * 1e6
+    return len(data), cpu_us
+
+def main():
+    client = good_energy.app.test_client()
+    compact_provider = good_energy.app.json
+    default_provider = DefaultJSONProvider(good_energy.app)
+    encoding = 'br' if good_energy.brotli is not None else 'gzip'
+    good_energy.app.json = default_provider # Captura o conteúdo sem arredondamento
+
+    devices_path = use_large_devices_file()
+    print(f"Compressão acima de {good_energy.COMPRESSION_MIN_BYTES} bytes")
+    print(f"orjson: {'sim' if good_energy.orjson else 'não'} | brotli: {'sim' if good_energy.brotli else 'não'}")
+    print(f"{'endpoint':<22}{'bytes antes':>12}{'bytes depois':>14}{'CPU antes (us)':>16}{'CPU depois (us)':>17}")
+    try:
+        for label, old_url, new_url in ENDPOINTS:
+            old_bytes, old_cpu = measure(default_provider, capture_payload(client, old_url))
+            new_bytes, new_cpu = measure(compact_provider, capture_payload(client, new_url), encoding)
+            print(f"{label:<22}{old_bytes:>12}{new_bytes:>14}{old_cpu:>16.0f}{new_cpu:>17.0f}")
+    finally:
+        good_energy.app.json = compact_provider
+        os.remove(devices_path)
+
+if __name__ == '__main__':
+    main()